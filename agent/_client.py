@@ -0,0 +1,50 @@
+import asyncio
+import functools
+import os
+import weakref
+from typing import TYPE_CHECKING, Callable, TypeVar
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+T = TypeVar("T")
+
+def per_loop(factory: Callable[[], T]) -> Callable[[], T]:
+    """Memoizes `factory()` per running event loop.
+
+    Async HTTP clients pool connections that are bound to the loop they were opened on, so a
+    client created under one `asyncio.run` fails with "Event loop is closed" under the next.
+    Each loop gets its own instance instead; it is dropped together with its loop.
+    """
+    instances: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, T]" = weakref.WeakKeyDictionary()
+
+    @functools.wraps(factory)
+    def getter() -> T:
+        loop = asyncio.get_running_loop()
+        if loop not in instances:
+            instances[loop] = factory()
+        return instances[loop]
+
+    return getter
+
+@per_loop
+def get_client() -> "AsyncOpenAI":
+    """Returns the OpenAI client of the running event loop.
+
+    Sharing one client reuses its pooled HTTP/2 connections (and their TLS sessions) across the
+    agent, the vision tool and the judge, and keeps the retry policy in one place. It is created
+    on first use rather than at import so that `.env` has been loaded by then, and so that
+    importing the agent does not pull in openai and httpx. Must be called from a coroutine.
+    """
+    import httpx
+    from openai import AsyncOpenAI
+
+    return AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        max_retries=3,
+        timeout=30.0,
+        http_client=httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        ),
+    )
@@ -0,0 +1,230 @@
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Set, Tuple
+
+if TYPE_CHECKING:
+    from openai.types.chat import ChatCompletion
+
+DEFAULT_CACHE_PATH = os.path.expanduser("~/.bluesky_agent_cache.sqlite")
+EMBEDDING_MODEL = "text-embedding-3-small"
+SIMILARITY_THRESHOLD = 0.95
+# Micro-batching limits for embedding requests: flush at this many inputs or after this many seconds
+EMBEDDING_BATCH_SIZE = 100
+EMBEDDING_BATCH_WINDOW = 0.1
+
+def _hash(payload: Any) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """SQLite-backed response store with an exact-key tier and a semantic (embedding) tier."""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, threshold: float = SIMILARITY_THRESHOLD):
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, context TEXT NOT NULL, vector BLOB NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_context ON embeddings (context)")
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO responses (key, value) VALUES (?, ?)", (key, value))
+
+    def add_embedding(self, key: str, context: str, vector: List[float]):
+        import numpy as np
+
+        blob = np.asarray(vector, dtype=np.float32).tobytes()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO embeddings (key, context, vector) VALUES (?, ?, ?)", (key, context, blob)
+            )
+
+    def nearest(self, context: str, vector: List[float]) -> Optional[str]:
+        """Returns the stored value whose embedding is most similar to `vector` within `context`, if above threshold."""
+        with self._lock:
+            rows = self._conn.execute("SELECT key, vector FROM embeddings WHERE context = ?", (context,)).fetchall()
+        if not rows:
+            return None
+
+        import numpy as np
+
+        query = np.asarray(vector, dtype=np.float32)
+        matrix = np.stack([np.frombuffer(blob, dtype=np.float32) for _, blob in rows])
+        norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+        similarities = matrix @ query / np.where(norms == 0, 1, norms)
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            return None
+        return self.get(rows[best][0])
+
+class EmbeddingBatcher:
+    """Coalesces concurrent embedding requests into batched `embeddings.create` calls.
+
+    A batch is sent once it holds `max_batch` inputs or `window` seconds after its first
+    input arrived, whichever comes first, and each caller gets its own vector back.
+    """
+
+    def __init__(self, create: Callable, model: str = EMBEDDING_MODEL,
+                 max_batch: int = EMBEDDING_BATCH_SIZE, window: float = EMBEDDING_BATCH_WINDOW):
+        self.create = create
+        self.model = model
+        self.max_batch = max_batch
+        self.window = window
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # Keeps in-flight batch requests referenced until they finish
+        self._requests: Set[asyncio.Task] = set()
+
+    async def embed(self, text: str) -> List[float]:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Inputs and timers left over from an earlier event loop can never be sent
+            self._loop, self._pending, self._timer = loop, [], None
+        future = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            request = asyncio.get_running_loop().create_task(self._send(batch))
+            self._requests.add(request)
+            request.add_done_callback(self._requests.discard)
+
+    async def _send(self, batch: List[Tuple[str, asyncio.Future]]):
+        try:
+            result = await self.create(model=self.model, input=[text for text, _ in batch])
+            vectors = [item.embedding for item in sorted(result.data, key=lambda item: item.index)]
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), vector in zip(batch, vectors):
+            if not future.done():
+                future.set_result(vector)
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+# One batcher per embed function, so that every wrapper (e.g. one agent per model) shares its batches
+_batchers: Dict[Callable, EmbeddingBatcher] = {}
+
+def get_cache() -> Optional[ResponseCache]:
+    """Returns the shared cache, or None when disabled via BLUESKY_AGENT_CACHE=off."""
+    global _cache
+    path = os.getenv("BLUESKY_AGENT_CACHE", DEFAULT_CACHE_PATH)
+    if path.lower() in ("", "0", "off"):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(path)
+    return _cache
+
+def _last_user_text(messages: List[Dict]) -> Optional[str]:
+    if messages and messages[-1].get("role") == "user" and isinstance(messages[-1].get("content"), str):
+        return messages[-1]["content"]
+    return None
+
+def cached_llm_call(create: Callable, embed: Optional[Callable] = None, stream: Optional[Callable] = None) -> Callable:
+    """Wraps an async `chat.completions.create` with the response cache.
+
+    Requests are first looked up by a hash of all their arguments. On a miss, if
+    `embed` (an async `embeddings.create`) is given, the last user message is
+    embedded and compared against earlier requests that share the same model,
+    preceding messages, options and `cache_scope`. Embeddings of concurrent
+    misses, across all wrappers given the same `embed`, are sent together through
+    one `EmbeddingBatcher`.
+
+    `cache_scope` identifies what the request is about (e.g. the post), so that a
+    semantic hit never replays a completion made for something else. It is not
+    sent to the API.
+
+    If the wrapper is called with `on_token`, a miss is sent through `stream`
+    (called as `stream(on_token, **kwargs)`, returning the final completion) when
+    given, and a hit replays its content to `on_token` in one piece.
+    """
+    batcher = _batchers.setdefault(embed, EmbeddingBatcher(embed)) if embed is not None else None
+
+    @functools.wraps(create)
+    async def wrapper(*, cache_scope: Optional[str] = None, on_token: Optional[Callable[[str], None]] = None,
+                      **kwargs) -> "ChatCompletion":
+        async def complete() -> "ChatCompletion":
+            if on_token is not None and stream is not None:
+                return await stream(on_token, **kwargs)
+            return replay(await create(**kwargs))
+
+        def replay(response: "ChatCompletion") -> "ChatCompletion":
+            if on_token is not None and response.choices[0].message.content:
+                on_token(response.choices[0].message.content)
+            return response
+
+        cache = get_cache()
+        if cache is None or kwargs.get("stream"):
+            return await complete()
+
+        from openai.types.chat import ChatCompletion
+
+        key = _hash(kwargs)
+        hit = cache.get(key)
+        if hit is not None:
+            return replay(ChatCompletion.model_validate_json(hit))
+
+        context, vector = None, None
+        text = _last_user_text(kwargs.get("messages", []))
+        if batcher is not None and text:
+            context = _hash({**kwargs, "messages": kwargs["messages"][:-1], "cache_scope": cache_scope})
+            try:
+                vector = await batcher.embed(text)
+            except Exception:
+                vector = None
+            if vector is not None:
+                hit = cache.nearest(context, vector)
+                if hit is not None:
+                    return replay(ChatCompletion.model_validate_json(hit))
+
+        response = await complete()
+        cache.set(key, response.model_dump_json())
+        if vector is not None:
+            cache.add_embedding(key, context, vector)
+        return response
+
+    return wrapper
+
+def cached_tool_call(execute: Callable) -> Callable:
+    """Caches an async Tool.execute method on exact (tool name, arguments) matches. Error results are not stored."""
+    @functools.wraps(execute)
+    async def wrapper(self, **kwargs) -> str:
+        cache = get_cache()
+        if cache is None:
+            return await execute(self, **kwargs)
+        key = _hash({"tool": self.name, "kwargs": kwargs})
+        hit = cache.get(key)
+        if hit is not None:
+            return hit
+        result = await execute(self, **kwargs)
+        if result and not result.startswith("Error"):
+            cache.set(key, result)
+        return result
+
+    return wrapper
@@ -1,138 +1,373 @@
 
+import asyncio
 import json
-import os
-from typing import List, Dict, Any, Optional
-from openai import OpenAI
-from pydantic import BaseModel
+import logging
+import re
+from typing import List, Dict, Any, Callable, Optional, Tuple
 
+from agent._client import get_client
+from agent.cache import cached_llm_call
 from agent.tools import get_tools
 
-# --- Pydantic Models for Structured Output (Optional but recommended for robustness) ---
-# For this simplified implementation, we'll use strong prompt engineering + parsing 
-# to keep it flexible, or we could use `response_format` if the model supports it well.
-# We will use a dedicated method to parse the LLM's "Thought: ... Action: ..." format.
+logger = logging.getLogger("bluesky_agent")
+
+# Parser for the planner joiner's output format
+_FINAL_RE = re.compile(r'Final Answer:\s*(.*)', re.S)
+# "$<id>" references to earlier plan nodes' outputs in a node's input
+_NODE_REF_RE = re.compile(r'\$(\d+)\b')
+_TOKEN_RE = re.compile(r'\w+')
+
+# Only posts up to this many words are searched speculatively; longer ones make poor queries
+SPECULATIVE_SEARCH_MAX_WORDS = 8
+# Minimum token overlap between a search query and the post text to reuse the speculative search
+SPECULATIVE_SEARCH_SIMILARITY = 0.6
+
+def _jaccard(a: str, b: str) -> float:
+    """Jaccard similarity of the lowercase word sets of two strings."""
+    tokens_a, tokens_b = set(_TOKEN_RE.findall(a.lower())), set(_TOKEN_RE.findall(b.lower()))
+    if not tokens_a or not tokens_b:
+        return 0.0
+    return len(tokens_a & tokens_b) / len(tokens_a | tokens_b)
+
+async def _create_embedding(**kwargs) -> Any:
+    """`embeddings.create` on the running loop's client; one function shared by all agents so they share a batcher."""
+    return await get_client().embeddings.create(**kwargs)
 
 class BlueskyAgent:
-    def __init__(self, model_name: str = "gpt-4o"):
-        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    def __init__(self, model_name: str = "gpt-4o", planner: bool = False):
+        # The client is looked up per call, since each event loop has its own (see get_client)
+        self._complete = cached_llm_call(
+            lambda **kwargs: get_client().chat.completions.create(**kwargs),
+            embed=_create_embedding,
+            stream=self._stream_completion
+        )
         self.model_name = model_name
         self.tools = get_tools()
-        self.max_steps = 5
-        self.history: List[Dict[str, str]] = []
+        # Fetch, vision and search, plus the final answer
+        self.max_steps = 4
+        # Planner mode: plan all tool calls up front, run them as a DAG, then answer once
+        self.planner = planner
+        self.max_plan_rounds = 2
+        # The tools never change after construction, so the prompt is built once and
+        # stays byte-identical across requests (lets OpenAI prompt caching kick in)
+        self._system_prompt = self._construct_system_prompt()
+        self._tool_schemas = self._construct_tool_schemas()
+        self._planner_prompt = self._construct_planner_prompt()
+        self._joiner_prompt = self._construct_joiner_prompt()
+
+    @property
+    def client(self):
+        """The OpenAI client of the running event loop."""
+        return get_client()
 
     def _construct_system_prompt(self) -> str:
+        return """Explain Bluesky posts, memes, and technical jargon to a general audience.
+Call tools until you have enough context, then reply with the explanation as bullets:
+* [Point] (Source)
+* ...
+
+Protocol:
+1. Content missing, URL given -> `bluesky_fetch`.
+2. Image URL in post -> `vision`.
+3. Simple, common knowledge -> answer. Do not search.
+4. Jargon, memes, or slang not explained by the image -> `search`. No results -> new query.
+5. Independent tool calls (e.g. `vision` and `search`) -> make them together in one turn.
+"""
+
+    def _construct_tool_schemas(self) -> List[Dict[str, Any]]:
+        """Describes each tool as an OpenAI function taking its INPUT_KW as the only string argument."""
+        return [
+            {
+                "type": "function",
+                "function": {
+                    "name": name,
+                    "description": tool.description,
+                    "strict": True,
+                    "parameters": {
+                        "type": "object",
+                        "properties": {tool.INPUT_KW: {"type": "string"}},
+                        "required": [tool.INPUT_KW],
+                        "additionalProperties": False
+                    }
+                }
+            }
+            for name, tool in self.tools.items()
+        ]
+
+    def _construct_planner_prompt(self) -> str:
         tool_descriptions = "\n".join([f"- {name}: {tool.description}" for name, tool in self.tools.items()])
-        
-        return f"""You are an advanced AI assistant designed to explain Bluesky posts, memes, and technical jargon to a general audience.
+
+        return f"""You plan the tool calls needed to explain a Bluesky post to a general audience.
 You have access to the following tools:
 
 {tool_descriptions}
 
-You function as a ReAct (Reason + Act) agent. For each step, you must follow this format STRICTLY:
+Output valid JSON only, listing every tool call needed as a node:
+{{
+    "nodes": [
+        {{"id": 1, "tool": "<tool name>", "input": "<tool input>", "deps": []}}
+    ]
+}}
 
-Thought: [Your reasoning about what information is missing or what to do next]
-Action: [The name of the tool to use, e.g., 'search' or 'vision']
-Action Input: [The input for the tool, e.g., a search query or image URL]
+RULES:
+- "tool" must be one of {list(self.tools.keys())}.
+- Nodes without dependencies run in parallel, so only add a dependency when a node needs another node's output.
+- A node may only depend on nodes listed before it. Write "$<id>" in "input" to insert that node's output.
+- If the post content is missing but a URL is provided, plan only `bluesky_fetch`; you will plan again with the fetched text.
+- Use `vision` for every image URL in the post.
+- Use `search` only for technical jargon, memes, or slang. Do not search simple, common knowledge.
+- Output {{"nodes": []}} if no tools are needed.
+"""
+
+    def _construct_joiner_prompt(self) -> str:
+        return """You explain Bluesky posts, memes, and technical jargon to a general audience, using the tool observations provided.
 
-Once you receive an Observation, you will repeat the cycle until you have enough information.
-When you are ready to provide the final answer, use this format:
+If the observations are enough, answer in this format:
 
-Thought: I have sufficient information.
 Final Answer:
 * [Point 1] (Source)
 * [Point 2] (Source)
 * ...
 
-PROTOCOL (Prioritized Decision Tree):
+If essential information is still missing (e.g. the post text was only just fetched and its images or jargon are unexplained), answer with:
 
-1. **MISSING CONTENT CHECK**:
-   - Is the post content missing but a URL is provided?
-   - If YES: Use `bluesky_fetch` to retrieve the text.
-   - Then proceed to Step 2 with the fetched text.
+Replan: [What is missing]
+"""
 
-2. **CHECK FOR IMAGES (CONTEXT ASSEMBLY)**:
-   - Does the post (or fetched content) contain an image URL?
-   - If YES: **Use the `vision` tool immediately** to get a description.
-   - Combine the Post Text + Image Description for the next steps.
+    async def run(self, post_content: str, post_url: str = "", on_token: Optional[Callable[[str], None]] = None) -> str:
+        """Explains the post, using the planner or the ReAct loop depending on the agent mode.
 
-3. **ANALYZE CONTENT SIMPLICITY**: 
-   - Is the combined context (Text + Image) strictly about simple, common knowledge?
-   - If YES: **Do NOT search.** Provide a final Answer immediately.
-   - If NO: Proceed to step 4.
+        If `on_token` is given, LLM output is streamed to it token by token.
+        """
+        if self.planner:
+            return await self._run_planned(post_content, post_url, on_token)
+        return await self._run_react(post_content, post_url, on_token)
 
-4. **CHECK FOR JARGON/MEMES**:
-   - Does the post contain technical jargon, memes, or slang that isn't explained by the image?
-   - If YES: Use the `search` tool to find definitions or origins.
+    async def _generate(self, messages: List[Dict[str, Any]], on_token: Optional[Callable[[str], None]] = None,
+                        cache_scope: Optional[str] = None, **kwargs) -> Any:
+        """Returns the assistant message the (cached) LLM produces for `messages`.
 
-5. **FINALIZE**:
-   - Once you have enough context, provide the Final Answer.
+        With `on_token`, content tokens are streamed to it as they arrive; a cached
+        response is passed to it in one piece.
+        """
+        response = await self._complete(
+            model=self.model_name, messages=messages, cache_scope=cache_scope, on_token=on_token, **kwargs
+        )
+        if on_token is not None and response.choices[0].message.content:
+            on_token("\n")
+        return response.choices[0].message
 
-RULES:
-- "Action" must be one of {list(self.tools.keys())}.
-- If no search results are found, try a different query.
-- **Output the Final Answer as a list of bullet points.**
-"""
+    async def _stream_completion(self, on_token: Callable[[str], None], **kwargs) -> Any:
+        """Streams a completion's content tokens to `on_token` and returns the final completion."""
+        async with self.client.beta.chat.completions.stream(**kwargs) as stream:
+            async for event in stream:
+                if event.type == "content.delta":
+                    on_token(event.delta)
+            return await stream.get_final_completion()
 
-    def run(self, post_content: str, post_url: str = "") -> str:
-        """Runs the ReAct loop to explain the post."""
-        
-        # Reset history for a new run
-        self.history = [
-            {"role": "system", "content": self._construct_system_prompt()},
-            {"role": "user", "content": f"Please explain this Bluesky post:\nURL: {post_url}\nContent: {post_content}"}
-        ]
+    async def _call_tool(self, action_name: str, action_input: str) -> str:
+        """Dispatches a tool call by name, passing the input as the tool's INPUT_KW argument."""
+        tool = self.tools[action_name]
+        result = await tool.execute(**{tool.INPUT_KW: action_input})
+        # Tool messages need string content; e.g. the vision model returns None when it refuses
+        return str(result) if result is not None else f"Error: {action_name} returned no result."
 
-        step_count = 0
-        
-        while step_count < self.max_steps:
-            print(f"--- Step {step_count + 1} ---")
-            
-            # 1. Call LLM
-            response = self.client.chat.completions.create(
+    async def _run_planned(self, post_content: str, post_url: str, on_token: Optional[Callable[[str], None]] = None) -> str:
+        """Plans the tool calls as a DAG, runs independent calls concurrently, then joins the observations into an answer."""
+        request = f"Please explain this Bluesky post:\nURL: {post_url}\nContent: {post_content}"
+        # Keeps semantic cache hits to completions made for this same post
+        cache_scope = post_url or post_content
+        observations: List[str] = []
+        # Successful tool results of this run by (tool, input), so a repeated call is not re-executed
+        tool_cache: Dict[Tuple[str, str], str] = {}
+
+        for round_count in range(self.max_plan_rounds):
+            logger.info("--- Plan %d ---", round_count + 1)
+
+            # 1. Plan
+            context = "\n\n".join([request, *observations])
+            response = await self._complete(
                 model=self.model_name,
-                messages=self.history,
-                stop=["Observation:"] # Stop before the agent hallucinates an observation
+                messages=[
+                    {"role": "system", "content": self._planner_prompt},
+                    {"role": "user", "content": context}
+                ],
+                response_format={"type": "json_object"},
+                cache_scope=cache_scope
             )
-            
-            llm_output = response.choices[0].message.content.strip()
-            self.history.append({"role": "assistant", "content": llm_output})
-            print(f"{llm_output}")
+            try:
+                nodes = self._valid_nodes(json.loads(response.choices[0].message.content).get("nodes", []))
+            except (json.JSONDecodeError, AttributeError):
+                nodes = []
+            logger.info("Plan: %s", nodes)
 
-            # 2. Parse Output
-            if "Final Answer:" in llm_output:
-                return llm_output.split("Final Answer:")[1].strip()
+            # 2. Execute the DAG
+            results = await self._execute_plan(nodes, tool_cache)
+            for node in nodes:
+                result = results.get(str(node.get("id")))
+                if result is not None:
+                    observations.append(f"Observation ({node.get('tool')}: {node.get('input')}): {result}")
+                    logger.info("Observation (%s): %.200s...", node.get('tool'), result) # Truncate for logging
 
-            if "Action:" in llm_output and "Action Input:" in llm_output:
-                # Extract Action and Action Input
-                try:
-                    action_line = [line for line in llm_output.split('\n') if line.startswith("Action:")][0]
-                    action_name = action_line.split("Action:")[1].strip().lower()
-                    
-                    input_line = [line for line in llm_output.split('\n') if line.startswith("Action Input:")][0]
-                    action_input = input_line.split("Action Input:")[1].strip()
-                    
-                    # 3. Execute Tool
-                    if action_name in self.tools:
-                        if action_name == 'search':
-                            tool_result = self.tools[action_name].execute(query=action_input)
-                        elif action_name == 'bluesky_fetch':
-                            tool_result = self.tools[action_name].execute(url=action_input)
-                        else:
-                            # Default to image_url for vision or others
-                            tool_result = self.tools[action_name].execute(image_url=action_input)
-                            
-                        observation = f"Observation: {tool_result}"
-                        print(f"Observation: {tool_result[:200]}...") # Truncate for logging
-                    else:
-                        observation = f"Observation: Error: Tool '{action_name}' not found."
+            # 3. Join
+            context = "\n\n".join([request, *observations])
+            if round_count + 1 == self.max_plan_rounds:
+                context += "\n\nNo more tools are available; give the Final Answer."
+            message = await self._generate(
+                [
+                    {"role": "system", "content": self._joiner_prompt},
+                    {"role": "user", "content": context}
+                ],
+                on_token,
+                cache_scope=cache_scope
+            )
+            llm_output = (message.content or "").strip()
+            if on_token is None:
+                logger.info("%s", llm_output)
+
+            final_match = _FINAL_RE.search(llm_output)
+            if final_match:
+                return final_match.group(1).strip()
+            if not llm_output.startswith("Replan:"):
+                return llm_output
+
+        return "Error: Maximum planning rounds reached without a final answer."
+
+    @staticmethod
+    def _valid_nodes(nodes: Any) -> List[Dict[str, Any]]:
+        """Drops plan nodes that are not objects or repeat an earlier node's id."""
+        if not isinstance(nodes, list):
+            return []
+        valid, seen_ids = [], set()
+        for node in nodes:
+            if not isinstance(node, dict) or str(node.get("id")) in seen_ids:
+                logger.warning("Skipping invalid plan node: %s", node)
+                continue
+            if not isinstance(node.get("deps", []), list):
+                node = {**node, "deps": []}
+            seen_ids.add(str(node.get("id")))
+            valid.append(node)
+        return valid
+
+    async def _execute_plan(self, nodes: List[Dict[str, Any]], tool_cache: Dict[Tuple[str, str], str]) -> Dict[str, str]:
+        """Runs each plan node as soon as its dependencies are done. Returns the tool outputs by node id."""
+        tasks: Dict[str, asyncio.Task] = {}
+
+        async def run_when_ready(node: Dict[str, Any], deps: List[str]) -> str:
+            dep_results = dict(zip(deps, await asyncio.gather(*[tasks[dep] for dep in deps])))
+            action_input = _NODE_REF_RE.sub(
+                lambda ref: dep_results.get(ref.group(1), ref.group(0)), str(node.get("input", ""))
+            )
+
+            action_name = str(node.get("tool", "")).lower()
+            if action_name not in self.tools:
+                return f"Error: Tool '{action_name}' not found."
+            if (action_name, action_input) in tool_cache:
+                return tool_cache[(action_name, action_input)]
+            try:
+                result = await self._call_tool(action_name, action_input)
+            except Exception as e:
+                return f"Error running {action_name}: {str(e)}"
+            if result and not result.startswith("Error"):
+                tool_cache[(action_name, action_input)] = result
+            return result
+
+        for node in nodes:
+            # "$<id>" references in the input are dependencies too, even if not listed in "deps".
+            # Only earlier nodes count as dependencies, which rules out cycles
+            refs = _NODE_REF_RE.findall(str(node.get("input", "")))
+            deps = list(dict.fromkeys(dep for dep in [*map(str, node.get("deps", [])), *refs] if dep in tasks))
+            tasks[str(node.get("id"))] = asyncio.create_task(run_when_ready(node, deps))
 
+        results = await asyncio.gather(*tasks.values())
+        return dict(zip(tasks.keys(), results))
+
+    async def _run_react(self, post_content: str, post_url: str, on_token: Optional[Callable[[str], None]] = None) -> str:
+        """Runs the tool-calling loop to explain the post."""
+        
+        # The system prompt and the post never change during a run, so they form a fixed prefix
+        # and every step's request starts with the same messages (OpenAI prompt caching reuses it).
+        # Both are local to the run so one agent can serve concurrent runs.
+        prefix = (
+            {"role": "system", "content": self._system_prompt},
+            {"role": "user", "content": f"Please explain this Bluesky post:\nURL: {post_url}\nContent: {post_content}"}
+        )
+        turns: List[Dict[str, Any]] = []
+        # Keeps semantic cache hits to completions made for this same post
+        cache_scope = post_url or post_content
+
+        # Successful tool results of this run by (tool, input), so a repeated call is not re-executed
+        tool_cache: Dict[Tuple[str, str], str] = {}
+
+        # Search a short post's text in the background while the LLM (and any vision call) runs;
+        # if the agent later searches for roughly the post text, the result is already there
+        speculative_search = None
+        if 0 < len(_TOKEN_RE.findall(post_content)) <= SPECULATIVE_SEARCH_MAX_WORDS:
+            speculative_search = asyncio.create_task(self.tools['search'].execute(query=post_content))
+
+        async def run_tool_call(tool_call) -> str:
+            action_name = tool_call.function.name
+            if action_name not in self.tools:
+                return f"Error: Tool '{action_name}' not found."
+            try:
+                args = json.loads(tool_call.function.arguments or "{}")
+            except json.JSONDecodeError as e:
+                return f"Error: Invalid arguments for '{action_name}': {str(e)}"
+            action_input = str(args.get(self.tools[action_name].INPUT_KW, ""))
+            logger.info("Action: %s(%s)", action_name, action_input)
+
+            if (action_name, action_input) in tool_cache:
+                return tool_cache[(action_name, action_input)]
+            result = None
+            if (action_name == 'search' and speculative_search is not None
+                    and _jaccard(action_input, post_content) >= SPECULATIVE_SEARCH_SIMILARITY):
+                result = await speculative_search
+                # Tell the model which query these results are actually for
+                if result and not result.startswith("Error") and action_input != post_content:
+                    result = f"Search results for: {post_content}\n\n{result}"
+            # A failed speculative search is retried like any other call
+            if not result or result.startswith("Error"):
+                try:
+                    result = await self._call_tool(action_name, action_input)
                 except Exception as e:
-                    observation = f"Observation: Error parsing action: {str(e)}"
-            else:
-                 observation = "Observation: I need to specify an Action and Action Input to use a tool, or provide a Final Answer."
+                    return f"Error running {action_name}: {str(e)}"
+            if result and not result.startswith("Error"):
+                tool_cache[(action_name, action_input)] = result
+            return result
+
+        try:
+            for step_count in range(self.max_steps):
+                logger.info("--- Step %d ---", step_count + 1)
+            
+                # 1. Call LLM
+                message = await self._generate([*prefix, *turns], on_token, cache_scope=cache_scope, tools=self._tool_schemas)
+                if on_token is None and message.content:
+                    logger.info("%s", message.content)
+
+                # 2. No tool calls means the model has answered
+                if not message.tool_calls:
+                    return (message.content or "").strip()
+
+                turns.append({
+                    "role": "assistant",
+                    "content": message.content,
+                    "tool_calls": [
+                        {
+                            "id": tool_call.id,
+                            "type": "function",
+                            "function": {"name": tool_call.function.name, "arguments": tool_call.function.arguments}
+                        }
+                        for tool_call in message.tool_calls
+                    ]
+                })
 
-            # 4. Feed Observation back
-            self.history.append({"role": "user", "content": observation})
-            step_count += 1
+                # 3. Execute all requested tools concurrently and feed the results back
+                results = await asyncio.gather(*[run_tool_call(tool_call) for tool_call in message.tool_calls])
+                for tool_call, result in zip(message.tool_calls, results):
+                    logger.info("Observation: %.200s...", result) # Truncate for logging
+                    turns.append({"role": "tool", "tool_call_id": tool_call.id, "content": result})
 
-        return "Error: Maximum steps reached without a final answer."
+            return "Error: Maximum steps reached without a final answer."
+        finally:
+            if speculative_search is not None and not speculative_search.done():
+                speculative_search.cancel()
@@ -0,0 +1,23 @@
+import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+def setup_logging(level: int = logging.INFO) -> QueueListener:
+    """Routes the `bluesky_agent` loggers through a queue to a single stderr writer thread.
+
+    Logging calls only enqueue the record, so concurrent runs never block on stderr.
+    Returns the started listener; call `stop()` on it before exiting to flush pending records.
+    """
+    log_queue: queue.Queue = queue.Queue(-1)
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    listener = QueueListener(log_queue, handler)
+
+    logger = logging.getLogger("bluesky_agent")
+    logger.setLevel(level)
+    logger.addHandler(QueueHandler(log_queue))
+    logger.propagate = False
+
+    listener.start()
+    return listener
@@ -1,32 +1,96 @@
-import os
-import json
-from typing import List, Dict, Optional, Any
-from openai import OpenAI
-from ddgs import DDGS
+import asyncio
+import logging
+import re
+from functools import lru_cache
+from typing import Dict, Any
+from urllib.parse import parse_qs, urlparse
+
+from agent._client import get_client, per_loop
+from agent.cache import cached_tool_call
+
+logger = logging.getLogger("bluesky_agent.tools")
+
+# httpx, selectolax and atproto are imported on first use so that importing the tools
+# (e.g. for `main.py --help`) stays cheap.
+
+DDG_HTML_URL = "https://html.duckduckgo.com/html/"
+
+# https://bsky.app/profile/{handle}/post/{rkey}, ignoring any query string or fragment
+_BSKY_URL_RE = re.compile(r"(?:https?://)?bsky\.app/profile/([^/\s]+)/post/([^/?#\s]+)")
+
+@per_loop
+def _http_client():
+    """Shared across searches so concurrent and repeated queries reuse pooled HTTP/2 connections.
+
+    One per event loop, since its connection pool is bound to the loop that opened it.
+    """
+    import httpx
+
+    return httpx.AsyncClient(
+        http2=True,
+        timeout=10,
+        headers={"User-Agent": "Mozilla/5.0 (compatible; BlueskyExplainer/1.0)"},
+    )
+
+@lru_cache(maxsize=None)
+def _bsky_client():
+    """Unauthenticated client on the public AppView, which serves public posts without a login."""
+    from atproto import Client
+
+    return Client("https://public.api.bsky.app")
+
+@lru_cache(maxsize=1024)
+def _resolve_did(handle: str) -> str:
+    """Resolves a handle to its DID. DIDs are stable, so results are memoized per process."""
+    return _bsky_client().resolve_handle(handle).did
+
+def _node_text(node) -> str:
+    """Text of an HTML node with whitespace collapsed."""
+    return " ".join(node.text().split())
+
+def _ddg_result_url(href: str) -> str:
+    """Unwraps DuckDuckGo's redirect links (//duckduckgo.com/l/?uddg=...) to the target URL."""
+    target = parse_qs(urlparse(href).query).get("uddg")
+    return target[0] if target else href
 
 class Tool:
     """Base class for all tools."""
     name: str = "base_tool"
     description: str = "Base tool description"
+    # Keyword argument of `execute` that receives the agent's action input
+    INPUT_KW: str = "input"
 
-    def execute(self, **kwargs) -> Any:
+    async def execute(self, **kwargs) -> Any:
         raise NotImplementedError
 
 class SearchTool(Tool):
     """Tool to search the web using DuckDuckGo."""
     name = "search"
+    INPUT_KW = "query"
     description = "Useful for finding current information, technical documentation, or explaining memes. Input should be a search query."
 
-    def execute(self, query: str, max_results: int = 5) -> str:
+    async def execute(self, query: str, max_results: int = 5) -> str:
         """Executes a search query and returns the results as a string."""
-        print(f"SEARCHING : {query}")
+        logger.info("SEARCHING : %s", query)
         try:
-            with DDGS() as ddgs:
-                results = list(ddgs.text(query, max_results=max_results))
-                
+            from selectolax.lexbor import LexborHTMLParser
+
+            resp = await _http_client().get(DDG_HTML_URL, params={"q": query})
+            resp.raise_for_status()
+
             formatted_results = []
-            for r in results:
-                formatted_results.append(f"Title: {r['title']}\nURL: {r['href']}\nSnippet: {r['body']}")
+            for result in LexborHTMLParser(resp.text).css("div.result:not(.result--ad)"):
+                link = result.css_first("a.result__a")
+                if link is None:
+                    continue
+                snippet = result.css_first(".result__snippet")
+                formatted_results.append(
+                    f"Title: {_node_text(link)}\n"
+                    f"URL: {_ddg_result_url(link.attributes.get('href') or '')}\n"
+                    f"Snippet: {_node_text(snippet) if snippet is not None else ''}"
+                )
+                if len(formatted_results) >= max_results:
+                    break
             
             return "\n\n".join(formatted_results) if formatted_results else "No results found."
         except Exception as e:
@@ -35,14 +99,15 @@ class SearchTool(Tool):
 class VisionTool(Tool):
     """Tool to analyze images using an external vision model (Placeholder)."""
     name = "vision"
+    INPUT_KW = "image_url"
     description = "Useful for describing the content of an image from a URL. Input should be the image URL."
 
-    def execute(self, image_url: str) -> str:
+    @cached_tool_call
+    async def execute(self, image_url: str) -> str:
         """Analyzes an image and returns a description using GPT-4o."""
-        print(f"ANALYZING IMAGE: {image_url}")
+        logger.info("ANALYZING IMAGE: %s", image_url)
         try:
-             client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-             response = client.chat.completions.create(
+             response = await get_client().chat.completions.create(
                 model="gpt-4o",
                 messages=[
                     {
@@ -67,60 +132,39 @@ class VisionTool(Tool):
 class BlueskyTool(Tool):
     """Tool to fetch post content from a Bluesky URL."""
     name = "bluesky_fetch"
+    INPUT_KW = "url"
     description = "Useful for fetching the actual text content of a Bluesky post given its URL. Input should be the full Bluesky post URL."
 
-    def execute(self, url: str) -> str:
+    async def execute(self, url: str) -> str:
         """Fetches post content using atproto."""
-        print(f"FETCHING BLUESKY POST: {url}")
+        logger.info("FETCHING BLUESKY POST: %s", url)
+        # The atproto client is blocking, so it runs in a worker thread
+        return await asyncio.to_thread(self._fetch, url)
+
+    def _fetch(self, url: str) -> str:
         try:
-            from atproto import Client, IdResolver
-            
-            # Anonymous public access (if supported) or unauthenticated fetching
-            # For public posts, we often don't need a login if using the proper XRPC endpoint,
-            # but atproto client usually expects login for many actions. 
-            # However, `get_post_thread` often works publicly on public PDS instances.
-            
-            # Simple workaround: Try unauthenticated client or just parse the URI if possible.
-            # actually atproto Client needs login usually.
-            # Let's try to use the public API without auth if possible, or fall back to error.
-            # For this demo, we'll try a public instance access pattern if library permits.
-            
             # Parsing the URL to get repo (handle) and rkey
-            # URL format: https://bsky.app/profile/{handle}/post/{rkey}
-            if "bsky.app/profile/" not in url or "/post/" not in url:
+            url_match = _BSKY_URL_RE.search(url)
+            if not url_match:
                 return "Error: Invalid Bluesky URL format."
-
-            parts = url.split("bsky.app/profile/")[1].split("/post/")
-            handle = parts[0]
-            rkey = parts[1].split("/")[0] # handle trailing slashes
-            
-            # To fetch without auth, we can use the public interface of a PDS like bsky.social
-            client = Client("https://public.api.bsky.app") 
+            handle, rkey = url_match.group(1), url_match.group(2)
             
             # Resolve handle to DID
-            did = client.resolve_handle(handle).did
+            did = _resolve_did(handle)
             
             # Get post
             uri = f"at://{did}/app.bsky.feed.post/{rkey}"
-            post_thread = client.get_post_thread(uri=uri)
+            post_thread = _bsky_client().get_post_thread(uri=uri)
             
-            if hasattr(post_thread.thread, 'post'):
-                post = post_thread.thread.post
-                record = post.record
-                content = f"Post Content by @{handle}:\n{record.text}"
+            post = getattr(post_thread.thread, 'post', None)
+            if post is not None:
+                content = f"Post Content by @{handle}:\n{post.record.text}"
                 
-                # Check for images in the post view embed
-                if hasattr(post, 'embed') and post.embed:
-                    # Check if it's a generic view with images (app.bsky.embed.images#view)
-                    if hasattr(post.embed, 'images'):
-                        for img in post.embed.images:
-                            if hasattr(img, 'fullsize'):
-                                content += f"\nImage URL: {img.fullsize}"
-                    # Check if it's a record with media (app.bsky.embed.recordWithMedia#view)
-                    elif hasattr(post.embed, 'media') and hasattr(post.embed.media, 'images'):
-                         for img in post.embed.media.images:
-                            if hasattr(img, 'fullsize'):
-                                content += f"\nImage URL: {img.fullsize}"
+                # Images sit on the embed view (app.bsky.embed.images#view) or, for a
+                # record with media (app.bsky.embed.recordWithMedia#view), on its media
+                embed = post.embed
+                images = getattr(embed, 'images', None) or getattr(getattr(embed, 'media', None), 'images', None) or ()
+                content += "".join(f"\nImage URL: {img.fullsize}" for img in images if getattr(img, 'fullsize', None))
                                 
                 return content
             else:
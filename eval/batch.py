@@ -0,0 +1,70 @@
+import asyncio
+import json
+import logging
+from typing import TYPE_CHECKING, Dict, List
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+logger = logging.getLogger("bluesky_agent.eval")
+
+# Batch statuses after which polling stops
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+class BatchHelper:
+    """Collects chat completion requests and runs them as one OpenAI Batch API job."""
+
+    def __init__(self, client: "AsyncOpenAI", endpoint: str = "/v1/chat/completions",
+                 completion_window: str = "24h", poll_interval: float = 30.0):
+        self.client = client
+        self.endpoint = endpoint
+        self.completion_window = completion_window
+        self.poll_interval = poll_interval
+        self.tasks: List[Dict] = []
+
+    def init_job(self):
+        """Starts a fresh job, discarding any queued tasks."""
+        self.tasks = []
+
+    def add_task(self, custom_id: str, body: Dict):
+        """Queues one request; `custom_id` is used to key its result."""
+        self.tasks.append({
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": self.endpoint,
+            "body": body,
+        })
+
+    async def run(self) -> Dict[str, Dict]:
+        """Uploads the queued tasks, waits for the batch to finish and returns response bodies by custom_id."""
+        if not self.tasks:
+            return {}
+
+        jsonl = "\n".join(json.dumps(task) for task in self.tasks).encode("utf-8")
+        input_file = await self.client.files.create(file=("batch_input.jsonl", jsonl), purpose="batch")
+        batch = await self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=self.endpoint,
+            completion_window=self.completion_window,
+        )
+        logger.info("Submitted batch %s with %d tasks", batch.id, len(self.tasks))
+
+        while batch.status not in TERMINAL_STATUSES:
+            await asyncio.sleep(self.poll_interval)
+            batch = await self.client.batches.retrieve(batch.id)
+            logger.info("Batch %s: %s", batch.id, batch.status)
+
+        if batch.status != "completed":
+            raise RuntimeError(f"Batch {batch.id} ended with status '{batch.status}'")
+
+        results = {}
+        if batch.output_file_id:
+            output = await self.client.files.content(batch.output_file_id)
+            for line in output.text.splitlines():
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                response = record.get("response") or {}
+                if response.get("status_code") == 200:
+                    results[record["custom_id"]] = response["body"]
+        return results
@@ -1,35 +1,55 @@
 
+import asyncio
 import json
-import os
+import logging
 import argparse
-from typing import List, Dict
-from openai import OpenAI
+from typing import Any, Awaitable, Callable, Iterable, Iterator, List, Dict, Tuple
+import ijson
+from pydantic import BaseModel, ConfigDict, Field
 from dotenv import load_dotenv
+from agent._client import get_client
 from agent.core import BlueskyAgent
+from agent.log import setup_logging
+from eval.batch import BatchHelper
 
 load_dotenv()
 
+logger = logging.getLogger("bluesky_agent.eval")
+
+JUDGE_MODEL = "gpt-4o-mini"
+
+class JudgeScore(BaseModel):
+    """Structured output schema for the judge."""
+    # Strict structured outputs require additionalProperties: false
+    model_config = ConfigDict(extra="forbid")
+
+    factuality: int = Field(..., ge=1, le=5)
+    utility: int = Field(..., ge=1, le=5)
+    reasoning: str
+
 class EvaluationHarness:
-    def __init__(self, cases_path: str = "eval/cases.json"):
-        with open(cases_path, "r") as f:
-            self.cases = json.load(f)
-        self.agent = BlueskyAgent()
-        self.judge_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    def __init__(self, cases_path: str = "eval/cases.json", concurrency: int = 16):
+        self.cases_path = cases_path
+        # Upper bound on cases in flight at once, to stay under OpenAI rate limits
+        self.concurrency = concurrency
+
+    @property
+    def cases(self) -> List[Dict]:
+        """All benchmark cases, read from the cases file."""
+        return list(self._iter_cases())
+
+    def _iter_cases(self) -> Iterator[Dict]:
+        """Streams the benchmark cases from the cases file one at a time."""
+        with open(self.cases_path, "rb") as f:
+            yield from ijson.items(f, "item", use_float=True)
 
-    def evaluate_case(self, case: Dict) -> Dict:
+    async def evaluate_case_async(self, agent: BlueskyAgent, case: Dict) -> Dict:
         """Runs the agent on a case and uses a Judge LLM to score it."""
-        print(f"\nRunning case {case['id']}: {case.get('post_content', 'Fetching URL...')[:50]}...")
-        
         # 1. Run Agent
-        try:
-            # Default content to empty string if not present, to trigger fetch
-            content_input = case.get('post_content', "")
-            agent_output = self.agent.run(post_content=content_input, post_url=case['post_url'])
-        except Exception as e:
-            agent_output = f"Error: {e}"
+        agent_output = await self._run_agent_async(agent, case)
 
         # 2. Judge Ouptut
-        score = self._judge_output(case['post_content'] if 'post_content' in case else "Contentfetched from URL", case['gold_standard'], agent_output)
+        score = await self._judge_output_async(self._original_post(case), case['gold_standard'], agent_output)
         
         return {
             "id": case['id'],
@@ -37,8 +57,22 @@ class EvaluationHarness:
             "scores": score
         }
 
-    def _judge_output(self, original_post: str, gold_standard: str, agent_output: str) -> Dict:
-        """Uses an LLM to score the output."""
+    async def _run_agent_async(self, agent: BlueskyAgent, case: Dict) -> str:
+        """Runs the agent on a case, returning the error text if it fails."""
+        logger.info("Running case %s on %s: %.50s...", case['id'], agent.model_name, case.get('post_content', 'Fetching URL...'))
+        try:
+            # Default content to empty string if not present, to trigger fetch
+            content_input = case.get('post_content', "")
+            return await agent.run(post_content=content_input, post_url=case['post_url'])
+        except Exception as e:
+            return f"Error: {e}"
+
+    @staticmethod
+    def _original_post(case: Dict) -> str:
+        return case['post_content'] if 'post_content' in case else "Contentfetched from URL"
+
+    def _judge_request(self, original_post: str, gold_standard: str, agent_output: str) -> Dict:
+        """Builds the chat completion request body for the judge."""
         prompt = f"""
         You are an impartial judge evaluating an AI agent's ability to explain social media posts.
         
@@ -51,48 +85,155 @@ class EvaluationHarness:
         1. Factuality: Is the information true and consistent with the Gold Standard?
         2. Utility: Is the explanation helpful, clear, and does it provide necessary context?
         
-        Output valid JSON only:
-        {{
-            "factuality": <int>,
-            "utility": <int>,
-            "reasoning": "<short explanation>"
-        }}
+        Give both scores and a short explanation as your reasoning.
         """
-        
+        return {
+            "model": JUDGE_MODEL,
+            "messages": [{"role": "system", "content": "You are an evaluation judge."}, {"role": "user", "content": prompt}],
+        }
+
+    async def _judge_output_async(self, original_post: str, gold_standard: str, agent_output: str) -> Dict:
+        """Uses an LLM to score the output."""
         try:
-            response = self.judge_client.chat.completions.create(
-                model="gpt-4o",
-                messages=[{"role": "system", "content": "You are an evaluation judge."}, {"role": "user", "content": prompt}],
-                response_format={"type": "json_object"}
+            response = await get_client().beta.chat.completions.parse(
+                **self._judge_request(original_post, gold_standard, agent_output),
+                response_format=JudgeScore
             )
-            return json.loads(response.choices[0].message.content)
         except Exception as e:
-            print(f"Judging error: {e}")
+            logger.warning("Judging error: %s", e)
             return {"factuality": 0, "utility": 0, "reasoning": "Error in judging."}
 
-    def run_benchmark(self, models: List[str] = ["gpt-4o", "gpt-4o-mini"]):
-        """Runs the evaluation harness across multiple models."""
-        benchmark_results = {}
+        score = response.choices[0].message.parsed
+        if score is None:
+            logger.warning("Judging refused: %s", response.choices[0].message.refusal)
+            return {"factuality": 0, "utility": 0, "reasoning": "Error in judging."}
+        return score.model_dump()
+
+    async def _map_bounded(self, fn: Callable[..., Awaitable], items: Iterable[Tuple]) -> List[Tuple[Tuple, Any]]:
+        """Awaits `fn(*item)` for each item, at most `self.concurrency` at a time.
+
+        The next item is only pulled from `items` once a slot is free, so streamed cases start
+        running while the rest of the file is still unread. Returns (item, result) pairs in order.
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks: List[asyncio.Task] = []
+
+        async def run(item: Tuple) -> Tuple[Tuple, Any]:
+            try:
+                return item, await fn(*item)
+            finally:
+                semaphore.release()
+
+        iterator = iter(items)
+        try:
+            while True:
+                await semaphore.acquire()
+                item = next(iterator, None)
+                if item is None:
+                    break
+                tasks.append(asyncio.create_task(run(item)))
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        return await asyncio.gather(*tasks)
+
+    async def run_benchmark_async(self, models: List[str] = ["gpt-4o", "gpt-4o-mini"]) -> Dict:
+        """Runs the evaluation harness across multiple models, evaluating every (model, case) pair concurrently."""
+        logger.info("====== Benchmarking Models: %s ======", ", ".join(models))
+        # BlueskyAgent.run keeps no per-run state on the agent, so one agent per model is shared by its cases
+        agents = {model: BlueskyAgent(model_name=model) for model in models}
+        results = await self._map_bounded(
+            lambda model, case: self.evaluate_case_async(agents[model], case),
+            ((model, case) for case in self._iter_cases() for model in models)
+        )
+        benchmark_results = self._summarize(models, ((model, result) for (model, _), result in results))
+
+        self._report(benchmark_results)
+        return benchmark_results
+
+    def run_benchmark(self, models: List[str] = ["gpt-4o", "gpt-4o-mini"]) -> Dict:
+        """Synchronous entry point for `run_benchmark_async`."""
+        return asyncio.run(self.run_benchmark_async(models=models))
+
+    async def run_benchmark_batched_async(self, models: List[str] = ["gpt-4o", "gpt-4o-mini"]) -> Dict:
+        """Runs the agents concurrently, then scores every output in a single Batch API job.
+
+        Batch jobs are cheaper but may take up to 24 hours to complete.
+        """
+        logger.info("====== Benchmarking Models: %s ======", ", ".join(models))
+        agents = {model: BlueskyAgent(model_name=model) for model in models}
+        outputs = await self._map_bounded(
+            lambda model, case: self._run_agent_async(agents[model], case),
+            ((model, case) for case in self._iter_cases() for model in models)
+        )
+
+        # Case ids repeat across models, so the model is part of the custom_id
+        batch = BatchHelper(get_client())
+        batch.init_job()
+        for (model, case), agent_output in outputs:
+            batch.add_task(
+                f"{model}:{case['id']}",
+                {
+                    **self._judge_request(self._original_post(case), case['gold_standard'], agent_output),
+                    "response_format": {
+                        "type": "json_schema",
+                        "json_schema": {"name": "JudgeScore", "schema": JudgeScore.model_json_schema(), "strict": True}
+                    }
+                },
+            )
+        try:
+            responses = await batch.run()
+        except Exception as e:
+            # Keep the agent outputs; every case falls back to the zero score below
+            logger.error("Batch judging failed: %s", e)
+            responses = {}
+
+        def scored():
+            for (model, case), agent_output in outputs:
+                body = responses.get(f"{model}:{case['id']}")
+                try:
+                    score = JudgeScore.model_validate_json(body["choices"][0]["message"]["content"]).model_dump()
+                except Exception as e:
+                    logger.warning("Judging error for case %s: %s", case['id'], e)
+                    score = {"factuality": 0, "utility": 0, "reasoning": "Error in judging."}
+                yield model, {
+                    "id": case['id'],
+                    "agent_output": agent_output,
+                    "scores": score
+                }
 
+        benchmark_results = self._summarize(models, scored())
+
+        self._report(benchmark_results)
+        return benchmark_results
+
+    def run_benchmark_batched(self, models: List[str] = ["gpt-4o", "gpt-4o-mini"]) -> Dict:
+        """Synchronous entry point for `run_benchmark_batched_async`."""
+        return asyncio.run(self.run_benchmark_batched_async(models=models))
+
+    def _summarize(self, models: List[str], scored: Iterable[Tuple[str, Dict]]) -> Dict:
+        """Aggregates (model, result) pairs into per-model averages and details in a single pass."""
+        details = {model: [] for model in models}
+        sum_fact = dict.fromkeys(models, 0)
+        sum_util = dict.fromkeys(models, 0)
+        for model, result in scored:
+            details[model].append(result)
+            sum_fact[model] += result['scores']['factuality']
+            sum_util[model] += result['scores']['utility']
+
+        benchmark_results = {}
         for model in models:
-            print(f"\n\n====== Benchmarking Model: {model} ======")
-            self.agent = BlueskyAgent(model_name=model)
-            
-            model_results = []
-            for case in self. cases:
-                result = self.evaluate_case(case)
-                model_results.append(result)
-            
-            # Calculate averages
-            avg_fact = sum(r['scores']['factuality'] for r in model_results) / len(model_results)
-            avg_util = sum(r['scores']['utility'] for r in model_results) / len(model_results)
-            
+            n = len(details[model]) or 1
             benchmark_results[model] = {
-                "avg_factuality": avg_fact,
-                "avg_utility": avg_util,
-                "details": model_results
+                "avg_factuality": sum_fact[model] / n,
+                "avg_utility": sum_util[model] / n,
+                "details": details[model]
             }
+        return benchmark_results
 
+    def _report(self, benchmark_results: Dict):
+        """Prints the summary table and writes the JSON and Markdown reports."""
         print("\n\n====== Final Component Benchmark Results ======")
         print(f"{'Model':<15} | {'Factuality':<12} | {'Utility':<12}")
         print("-" * 45)
@@ -114,5 +255,17 @@ class EvaluationHarness:
         print(f"Readable report saved to eval/benchmark_report.md")
 
 if __name__ == "__main__":
-    harness = EvaluationHarness()
-    harness.run_benchmark(models=["gpt-4o", "gpt-4o-mini"])
+    parser = argparse.ArgumentParser(description="Bluesky Explainer evaluation harness")
+    parser.add_argument("--batch", action="store_true", help="Score outputs through the OpenAI Batch API (cheaper, slower)")
+    parser.add_argument("--concurrency", type=int, default=16, help="Maximum number of (model, case) runs in flight")
+    args = parser.parse_args()
+
+    listener = setup_logging()
+    try:
+        harness = EvaluationHarness(concurrency=args.concurrency)
+        if args.batch:
+            harness.run_benchmark_batched(models=["gpt-4o", "gpt-4o-mini"])
+        else:
+            harness.run_benchmark(models=["gpt-4o", "gpt-4o-mini"])
+    finally:
+        listener.stop()
@@ -1,8 +1,10 @@
 
 import argparse
+import asyncio
 import os
 from dotenv import load_dotenv
 from agent.core import BlueskyAgent
+from agent.log import setup_logging
 
 # Load environment variables
 load_dotenv()
@@ -11,6 +13,7 @@ def main():
     parser = argparse.ArgumentParser(description="Bluesky Explainer Agent")
     parser.add_argument("--url", type=str, help="URL of the Bluesky post to explain")
     parser.add_argument("--content", type=str, help="Content of the post (optional if URL provided, but helpful)")
+    parser.add_argument("--planner", action="store_true", help="Plan all tool calls up front and run them in parallel instead of the step-by-step ReAct loop")
     
     args = parser.parse_args()
     
@@ -18,9 +21,8 @@ def main():
         print("Error: Please provide --url or --content.")
         return
 
-    # In a real scenario, we might scrape the URL to get the content if not provided.
-    # For simplicity, if content is missing, we'll ask the agent to try and find it or just use the URL context.
-    post_content = args.content if args.content else "Content not provided, please use variable search to find the post content if needed."
+    # If content is missing, the agent fetches it from the URL (same as the eval harness)
+    post_content = args.content if args.content else ""
     post_url = args.url if args.url else ""
 
     print(f"Initializing Bluesky Agent...\nURL: {post_url}\nContent: {post_content}\n")
@@ -29,15 +31,23 @@ def main():
         print("Error: OPENAI_API_KEY not found in environment variables.")
         return
 
+    listener = setup_logging()
     try:
-        agent = BlueskyAgent()
-        explanation = agent.run(post_content=post_content, post_url=post_url)
+        agent = BlueskyAgent(planner=args.planner)
+        # Print the agent's reasoning as it is generated
+        explanation = asyncio.run(agent.run(
+            post_content=post_content,
+            post_url=post_url,
+            on_token=lambda token: print(token, end="", flush=True)
+        ))
         
         print("\n=== Agent Explanation ===\n")
         print(explanation)
         
     except Exception as e:
         print(f"An error occurred: {e}")
+    finally:
+        listener.stop()
 
 if __name__ == "__main__":
     main()